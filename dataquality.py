@@ -0,0 +1,88 @@
+import pandas as pd
+import os
+
+# Rows kept in the reject file for each file and reason
+SAMPLE_ROWS = 20
+
+class QualityLog:
+    """Per-file counts of rows that were dropped or fell outside the fine bands, with a sample of each."""
+
+    def __init__(self):
+        self.counts = {}
+        self.samples = []
+        self.sampled = {}
+
+    def record(self, filename, data, checks):
+        """Classify the rows of `data` with the ordered (reason, boolean mask) pairs in `checks`.
+
+        Each row is counted under the first reason it matches, so the counts add up to the rows read.
+        """
+        counts = self.counts.setdefault(filename, {'Rows Read': 0})
+        counts['Rows Read'] += len(data)
+
+        unclassified = pd.Series(True, index=data.index)
+        for reason, mask in checks:
+            mask = mask & unclassified
+            unclassified &= ~mask
+            count = int(mask.sum())
+            counts[reason] = counts.get(reason, 0) + count
+
+            # Stop sampling once a file has enough rows for a reason, so chunked reads stay bounded
+            wanted = SAMPLE_ROWS - self.sampled.get((filename, reason), 0)
+            if count and wanted > 0:
+                rejected = data[mask]
+                if count > wanted:
+                    rejected = rejected.sample(wanted, random_state=0)
+                self.samples.append(rejected.assign(**{'Source File': filename, 'Reason': reason}))
+                self.sampled[(filename, reason)] = SAMPLE_ROWS - wanted + len(rejected)
+
+    def skip_file(self, filename, reason):
+        self.counts.setdefault(filename, {'Rows Read': 0})['Skipped File'] = reason
+
+    def merge(self, other):
+        """Add the counts and samples of another log, e.g. one returned by a worker process."""
+        for filename, other_counts in other.counts.items():
+            counts = self.counts.setdefault(filename, {'Rows Read': 0})
+            for column, value in other_counts.items():
+                if column == 'Skipped File':
+                    counts[column] = value
+                else:
+                    counts[column] = counts.get(column, 0) + value
+
+        # Keep the cap per file and reason while merging, so many worker logs stay bounded
+        for rejected in other.samples:
+            key = (rejected['Source File'].iat[0], rejected['Reason'].iat[0])
+            wanted = SAMPLE_ROWS - self.sampled.get(key, 0)
+            if wanted > 0:
+                rejected = rejected.head(wanted)
+                self.samples.append(rejected)
+                self.sampled[key] = self.sampled.get(key, 0) + len(rejected)
+
+    def save(self, directory, report_name):
+        """Write the per-file counts and the sampled reject rows to a data_quality folder in `directory`.
+
+        A sub folder keeps the CSV files out of the input folders that are scanned for '*.csv'. The
+        files are named after the report, so tools run from the same folder keep their own.
+        """
+        quality_directory = os.path.join(directory, 'data_quality')
+        os.makedirs(quality_directory, exist_ok=True)
+        counts_file = os.path.join(quality_directory, f'{report_name}_counts.csv')
+        rejects_file = os.path.join(quality_directory, f'{report_name}_rejects.csv')
+
+        counts = pd.DataFrame.from_dict(self.counts, orient='index')
+        counts.index.name = 'File'
+        for column in counts.columns:
+            if column == 'Skipped File':
+                counts[column] = counts[column].fillna('')
+            else:
+                counts[column] = counts[column].fillna(0).astype(int)
+        counts.sort_index().to_csv(counts_file)
+
+        if self.samples:
+            rejects = pd.concat(self.samples, ignore_index=True)
+            columns = ['Source File', 'Reason'] + [column for column in rejects.columns if column not in ('Source File', 'Reason')]
+            rejects[columns].to_csv(rejects_file, index=False)
+        else:
+            pd.DataFrame(columns=['Source File', 'Reason']).to_csv(rejects_file, index=False)
+
+        print(f"Data quality counts saved to '{counts_file}', sampled rejects to '{rejects_file}'.")
@@ -1,11 +1,54 @@
-import pandas as pd
+import time
+
+# Measure start-up from the first line of this script, so the report includes the imports and Tk
+# start-up. Interpreter start-up and unpacking of the packaged executable happen before and are not counted.
+startup_started = time.perf_counter()
+
 from datetime import datetime
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
-from tkcalendar import DateEntry
-from threading import Thread, Event
+from threading import Thread, Event, Lock
+
+# pandas, openpyxl and tkcalendar take seconds to import in the packaged executable,
+# so they are loaded in the background after the window is shown (see load_engine)
+pd = None
+save_excel = None
+DateEntry = None
+engine_lock = Lock()
+date_entry_lock = Lock()
+
+def load_engine():
+    """Import the processing libraries once, blocking until they are available."""
+    global pd, save_excel
+    with engine_lock:
+        if pd is None:
+            import pandas
+            import openpyxl  # Used by DataFrame.to_excel
+            import reportcache
+            save_excel = reportcache.save_excel
+            pd = pandas
+    return pd
+
+def load_date_entry():
+    global DateEntry
+    with date_entry_lock:
+        if DateEntry is None:
+            from tkcalendar import DateEntry as date_entry_class
+            DateEntry = date_entry_class
+    return DateEntry
+
+def warm_up():
+    started = time.perf_counter()
+    load_engine()
+    load_date_entry()
+    elapsed = time.perf_counter() - started
+    root.after(0, log_message, f"Processing engine loaded in {elapsed:.2f}s.\n")
+
+def log_message(message):
+    log_text.insert(tk.END, message)
+    log_text.see(tk.END)
 
 # Function to process the CSV files
 def process_all_csvs(directory, generate_daily, generate_monthly, start_date, end_date, log_text, progress_var, stop_event):
@@ -118,8 +161,10 @@ def process_all_csvs(directory, generate_daily, generate_monthly, start_date, en
 
         # Save the final aggregated daily DataFrame to Excel
         daily_report_path = os.path.join(reports_directory, 'ANPR_payment_details_daily.xlsx')
-        final_processed_data.to_excel(daily_report_path, index=False)
-        log_text.insert(tk.END, f"Daily details saved to '{daily_report_path}'.\n")
+        if save_excel(final_processed_data, daily_report_path, 'daily'):
+            log_text.insert(tk.END, f"Daily details saved to '{daily_report_path}'.\n")
+        else:
+            log_text.insert(tk.END, f"Daily details unchanged, '{daily_report_path}' is up to date.\n")
         log_text.see(tk.END)
         root.update()
 
@@ -143,8 +188,10 @@ def process_all_csvs(directory, generate_daily, generate_monthly, start_date, en
 
         # Save the month-wise summary to Excel
         monthly_report_path = os.path.join(reports_directory, 'ANPR_payment_details_monthly.xlsx')
-        month_wise_summary.to_excel(monthly_report_path, index=False)
-        log_text.insert(tk.END, f"Monthly summary saved to '{monthly_report_path}'.\n")
+        if save_excel(month_wise_summary, monthly_report_path, 'monthly'):
+            log_text.insert(tk.END, f"Monthly summary saved to '{monthly_report_path}'.\n")
+        else:
+            log_text.insert(tk.END, f"Monthly summary unchanged, '{monthly_report_path}' is up to date.\n")
         log_text.see(tk.END)
         root.update()
 
@@ -169,8 +216,10 @@ def process_all_csvs(directory, generate_daily, generate_monthly, start_date, en
         # Save the updated DataFrame with the sum row to Excel
         custom_report_filename = f'ANPR_payment_details_{start_date}_to_{end_date}.xlsx'
         custom_report_path = os.path.join(reports_directory, custom_report_filename)
-        filtered_data.to_excel(custom_report_path, index=False)
-        log_text.insert(tk.END, f"Details for {start_date} to {end_date} saved to '{custom_report_path}'.\n")
+        if save_excel(filtered_data, custom_report_path, 'custom'):
+            log_text.insert(tk.END, f"Details for {start_date} to {end_date} saved to '{custom_report_path}'.\n")
+        else:
+            log_text.insert(tk.END, f"Details for {start_date} to {end_date} unchanged, '{custom_report_path}' is up to date.\n")
         log_text.see(tk.END)
         root.update()
 
@@ -185,17 +234,53 @@ def select_directory():
     directory = filedialog.askdirectory()
     directory_var.set(directory)
 
+def scan_directory(directory, scan_id):
+    # Runs in the background so the file summary is ready before "Start Processing" is pressed
+    try:
+        sizes = [entry.stat().st_size for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith('.csv')]
+    except OSError:
+        sizes = None
+
+    def show_summary():
+        # Ignore results for a folder that is no longer selected
+        if scan_id != scan_counter[0]:
+            return
+        if sizes is None:
+            scan_summary_var.set("Folder not found.")
+        else:
+            scan_summary_var.set(f"{len(sizes)} CSV files, {sum(sizes) / (1024 * 1024):.1f} MB")
+
+    root.after(0, show_summary)
+
+def on_directory_changed(*_):
+    directory = directory_var.get()
+    scan_counter[0] += 1
+    if not directory:
+        scan_summary_var.set("")
+        return
+    scan_summary_var.set("Scanning folder...")
+    Thread(target=scan_directory, args=(directory, scan_counter[0]), daemon=True).start()
+
+def create_date_fields():
+    global start_date_entry, end_date_entry
+    if start_date_entry is None:
+        date_entry_class = load_date_entry()
+        start_date_entry = date_entry_class(root, date_pattern='yyyy-mm-dd')
+        end_date_entry = date_entry_class(root, date_pattern='yyyy-mm-dd')
+
 def toggle_date_fields():
     if custom_var.get():
+        create_date_fields()
         start_date_label.grid(row=5, column=0, sticky='w')
         start_date_entry.grid(row=5, column=1, padx=5)
         end_date_label.grid(row=6, column=0, sticky='w')
         end_date_entry.grid(row=6, column=1, padx=5)
     else:
         start_date_label.grid_remove()
-        start_date_entry.grid_remove()
         end_date_label.grid_remove()
-        end_date_entry.grid_remove()
+        if start_date_entry is not None:
+            start_date_entry.grid_remove()
+            end_date_entry.grid_remove()
 
 def start_processing_thread():
     # Disable the "Start Processing" button and enable the "Cancel" button
@@ -226,6 +311,9 @@ def start_processing():
             messagebox.showerror("Error", "Invalid date format. Please use YYYY-MM-DD.")
             return
 
+    # Waits for the background warm-up if it has not finished yet
+    load_engine()
+
     process_all_csvs(directory, generate_daily, generate_monthly, start_date, end_date, log_text, progress_var, stop_event)
 
 def cancel_processing():
@@ -241,6 +329,12 @@ tk.Label(root, text="Select Directory:").grid(row=0, column=0, sticky='w')
 tk.Entry(root, textvariable=directory_var, width=50).grid(row=0, column=1, padx=5)
 tk.Button(root, text="Browse", command=select_directory).grid(row=0, column=2, padx=5)
 
+# Summary of the selected folder, filled in by a background scan
+scan_summary_var = tk.StringVar()
+scan_counter = [0]
+tk.Label(root, textvariable=scan_summary_var).grid(row=0, column=3, sticky='w')
+directory_var.trace_add('write', on_directory_changed)
+
 # Option selections
 daily_var = tk.BooleanVar()
 monthly_var = tk.BooleanVar()
@@ -252,10 +346,11 @@ tk.Checkbutton(root, text="Generate Report for Custom Date Range", variable=cust
 
 # Date range input
 start_date_label = tk.Label(root, text="Start Date (YYYY-MM-DD):")
-start_date_entry = DateEntry(root, date_pattern='yyyy-mm-dd')
-
 end_date_label = tk.Label(root, text="End Date (YYYY-MM-DD):")
-end_date_entry = DateEntry(root, date_pattern='yyyy-mm-dd')
+
+# The calendar widgets are created on first use, once tkcalendar has been imported
+start_date_entry = None
+end_date_entry = None
 
 toggle_date_fields()  # Initially hide date fields
 
@@ -278,4 +373,12 @@ cancel_button.grid(row=10, column=1, pady=10, sticky='ew')
 # Event to control stopping the thread
 stop_event = Event()
 
+def report_startup():
+    elapsed = time.perf_counter() - startup_started
+    log_message(f"Window ready {elapsed:.2f}s after the script started running (interpreter start-up not included). Loading processing engine in the background...\n")
+    Thread(target=warm_up, daemon=True).start()
+
+# Runs once the window has been drawn
+root.after_idle(report_startup)
+
 root.mainloop()
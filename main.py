@@ -1,139 +1,200 @@
 import pandas as pd
 from datetime import datetime
 import os
-
-def process_all_csvs(directory, generate_daily, generate_monthly, start_date, end_date):
-    # Initialize the processed data DataFrame with the full date range
-    start_date_obj = datetime(2020, 12, 1).date()
+from reportcache import save_excel
+from dataquality import QualityLog
+
+# First day covered by the daily report, the last day is today
+REPORT_START_DATE = datetime(2020, 12, 1).date()
+
+# Columns of the daily report, in the order they appear in the workbook
+PAYMENT_COLUMNS = [
+    "No.of Cases Fine Collected",
+    "Total No. of 100 Rs Cases",
+    "Collected Fine Amount in 100 Rs",
+    "Total No. of 200 Rs Cases",
+    "Collected Fine Amount in 200 Rs",
+    "Total No. of 1000 Rs Cases",
+    "Collected Fine Amount in 1000 Rs",
+    "Total No. of Cases Fine Collected",
+    "Total Fine Amount Collected"
+]
+
+def read_payment_csv(filepath):
+    # Try reading the CSV with varying numbers of rows skipped
+    for skip in range(0, 21):
+        try:
+            data = pd.read_csv(filepath, skiprows=skip)
+
+            # Check if the required columns exist
+            if 'Payment Date' in data.columns and 'Challan Amount' in data.columns:
+                return data
+        except pd.errors.ParserError:
+            continue
+    return None
+
+def aggregate_payments(data):
+    """Sum the payments in one file per payment date, indexed by date with PAYMENT_COLUMNS."""
+    # A single text amount such as 'Rs 200' would turn the whole column into strings, count it as non-numeric instead
+    amount = pd.to_numeric(data['Challan Amount'], errors='coerce')
+    rows = pd.DataFrame({
+        "No.of Cases Fine Collected": 1,
+        "Total No. of 100 Rs Cases": (amount == 100).astype(int),
+        "Collected Fine Amount in 100 Rs": amount.where(amount == 100, 0),
+        "Total No. of 200 Rs Cases": (amount == 200).astype(int),
+        "Collected Fine Amount in 200 Rs": amount.where(amount == 200, 0),
+        "Total No. of 1000 Rs Cases": (amount == 1000).astype(int),
+        "Collected Fine Amount in 1000 Rs": amount.where(amount == 1000, 0),
+        "Total No. of Cases Fine Collected": 1,
+        "Total Fine Amount Collected": amount
+    }, index=data.index)
+    return rows.groupby(data['Payment Date']).sum()
+
+def payment_checks(payment_dates, amounts):
+    """Reasons a row is dropped from or only partly counted in the daily report, in priority order."""
+    payment_days = payment_dates.dt.normalize()
+    return [
+        ("Unparseable Payment Date", payment_dates.isna()),
+        ("Payment Date Outside Report Range", (payment_days < pd.Timestamp(REPORT_START_DATE)) | (payment_days > pd.Timestamp(datetime.today().date()))),
+        ("Missing Or Non-numeric Amount", amounts.isna()),
+        ("Amount Outside 100/200/1000 Bands", ~amounts.isin([100, 200, 1000]))
+    ]
+
+def aggregate_payment_file(filepath, quality=None):
+    """Read one challan export and return its daily payment totals, or None if it has no valid header.
+
+    If a QualityLog is given, rows that are dropped or fall outside the fine bands are recorded in it.
+    """
+    filename = os.path.basename(filepath)
+    data = read_payment_csv(filepath)
+
+    if data is None:
+        # If no valid header was found, skip this file
+        print(f"Valid header not found in {filename}. Skipping this file.")
+        if quality is not None:
+            quality.skip_file(filename, "Valid header not found")
+        return None
+
+    payment_dates = pd.to_datetime(data['Payment Date'], errors='coerce')
+    amounts = pd.to_numeric(data['Challan Amount'], errors='coerce')
+
+    # Classify the rows before the raw values are replaced, so the reject file shows the original values
+    if quality is not None:
+        quality.record(filename, data, payment_checks(payment_dates, amounts))
+
+    # The aggregation sees the same parsed amounts as the checks
+    data['Challan Amount'] = amounts
+
+    # Convert 'Payment Date' to datetime and normalize to just the date
+    data['Payment Date'] = payment_dates.dt.date
+
+    # Handle cases where dates couldn't be converted (if any)
+    if data['Payment Date'].isnull().any():
+        print(f"Some dates in {filename} could not be converted and will be ignored.")
+
+    # Filter out rows where 'Payment Date' couldn't be parsed
+    data = data.dropna(subset=['Payment Date'])
+
+    return aggregate_payments(data)
+
+def build_daily_frame(daily_totals):
+    """Add up per-file daily totals over the full date range from 2020-12-01 to today."""
+    start_date_obj = REPORT_START_DATE
     end_date_obj = datetime.today().date()
     date_range = pd.date_range(start=start_date_obj, end=end_date_obj, freq='D')
     date_range = [d.date() for d in date_range]  # Convert to datetime.date
 
-    # Create the output DataFrame
-    final_processed_data = pd.DataFrame({
-        "Date": date_range,
-        "No.of Cases Fine Collected": 0,
-        "Total No. of 100 Rs Cases": 0,
-        "Collected Fine Amount in 100 Rs": 0,
-        "Total No. of 200 Rs Cases": 0,
-        "Collected Fine Amount in 200 Rs": 0,
-        "Total No. of 1000 Rs Cases": 0,
-        "Collected Fine Amount in 1000 Rs": 0,
-        "Total No. of Cases Fine Collected": 0,
-        "Total Fine Amount Collected": 0
-    })
+    daily_totals = [totals for totals in daily_totals if totals is not None]
+    if daily_totals:
+        combined = pd.concat(daily_totals).groupby(level=0).sum()
+    else:
+        combined = pd.DataFrame(columns=PAYMENT_COLUMNS)
 
-    # Iterate over each file in the directory
-    for filename in os.listdir(directory):
-        if filename.endswith('.csv'):
-            filepath = os.path.join(directory, filename)
-            print(f"Processing file: {filename}")
+    # Dates outside the range are ignored, days without payments are 0
+    final_processed_data = combined.reindex(index=date_range, columns=PAYMENT_COLUMNS, fill_value=0)
+    final_processed_data.index.name = 'Date'
+    return final_processed_data.reset_index()
 
-            # Try reading the CSV with varying numbers of rows skipped
-            header_found = False
-            for skip in range(0, 21):
-                try:
-                    data = pd.read_csv(filepath, skiprows=skip)
-                    
-                    # Check if the required columns exist
-                    if 'Payment Date' in data.columns and 'Challan Amount' in data.columns:
-                        header_found = True
-                        break
-                except pd.errors.ParserError:
-                    continue
-
-            if not header_found:
-                # If no valid header was found, skip this file
-                print(f"Valid header not found in {filename}. Skipping this file.")
-                continue
+def save_daily_report(final_processed_data, output_file):
+    """Write the daily report, returns False if the existing file already had the same content."""
+    # Calculate and append the sum row for the daily data
+    sum_row_daily = final_processed_data.sum(numeric_only=True)
+    sum_row_daily['Date'] = 'Total'
+    daily_report = final_processed_data._append(sum_row_daily, ignore_index=True)
 
-            # Convert 'Payment Date' to datetime and normalize to just the date
-            data['Payment Date'] = pd.to_datetime(data['Payment Date'], errors='coerce').dt.date
+    # Save the final aggregated daily DataFrame to Excel
+    return save_excel(daily_report, output_file, 'daily')
 
-            # Handle cases where dates couldn't be converted (if any)
-            if data['Payment Date'].isnull().any():
-                print(f"Some dates in {filename} could not be converted and will be ignored.")
+def save_monthly_report(final_processed_data, output_file):
+    # Create a month-wise summary by grouping and summing the daily data
+    month = pd.to_datetime(final_processed_data['Date'], errors='coerce').dt.to_period('M').rename('Month')
+    month_wise_summary = final_processed_data.groupby(month)[PAYMENT_COLUMNS].sum().reset_index()
+
+    # Calculate and append the sum row for the monthly data
+    sum_row_monthly = month_wise_summary.sum(numeric_only=True)
+    sum_row_monthly['Month'] = 'Total'
+    month_wise_summary = month_wise_summary._append(sum_row_monthly, ignore_index=True)
 
-            # Filter out rows where 'Payment Date' couldn't be parsed
-            data = data.dropna(subset=['Payment Date'])
+    # Save the month-wise summary to Excel
+    return save_excel(month_wise_summary, output_file, 'monthly')
 
-            # Process data
-            for _, row in data.iterrows():
-                date = row['Payment Date']
-                challan_amount = row['Challan Amount']
+def save_custom_report(final_processed_data, start_date, end_date, output_file):
+    filtered_data = final_processed_data[
+        (final_processed_data['Date'] >= start_date) &
+        (final_processed_data['Date'] <= end_date)
+    ]
 
-                if date in final_processed_data['Date'].values:
-                    date_row = final_processed_data[final_processed_data['Date'] == date].index[0]
+    # Calculate the sum row for the specified date range
+    sum_row_custom = filtered_data[PAYMENT_COLUMNS].sum(numeric_only=True)
+    sum_row_custom['Date'] = 'Total'  # Label for the sum row
 
-                    if challan_amount == 100:
-                        final_processed_data.at[date_row, 'Total No. of 100 Rs Cases'] += 1
-                        final_processed_data.at[date_row, 'Collected Fine Amount in 100 Rs'] += challan_amount
-                    elif challan_amount == 200:
-                        final_processed_data.at[date_row, 'Total No. of 200 Rs Cases'] += 1
-                        final_processed_data.at[date_row, 'Collected Fine Amount in 200 Rs'] += challan_amount
-                    elif challan_amount == 1000:
-                        final_processed_data.at[date_row, 'Total No. of 1000 Rs Cases'] += 1
-                        final_processed_data.at[date_row, 'Collected Fine Amount in 1000 Rs'] += challan_amount
+    # Append the sum row to the DataFrame
+    filtered_data = filtered_data._append(sum_row_custom, ignore_index=True)
 
-                    final_processed_data.at[date_row, 'Total No. of Cases Fine Collected'] += 1
-                    final_processed_data.at[date_row, 'Total Fine Amount Collected'] += challan_amount
-                    final_processed_data.at[date_row, 'No.of Cases Fine Collected'] += 1
+    # Save the updated DataFrame with the sum row to Excel
+    return save_excel(filtered_data, output_file, 'custom')
 
+def process_all_csvs(directory, generate_daily, generate_monthly, start_date, end_date):
+    daily_totals = []
+    quality = QualityLog()
+
+    # Iterate over each file in the directory
+    for filename in os.listdir(directory):
+        if filename.endswith('.csv'):
+            filepath = os.path.join(directory, filename)
+            print(f"Processing file: {filename}")
+
+            file_totals = aggregate_payment_file(filepath, quality)
+            if file_totals is None:
+                continue
+
+            daily_totals.append(file_totals)
             print(f"Done processing file: {filename}")
 
-    # Calculate and append the sum row for the daily data
-    if generate_daily:
-        sum_row_daily = final_processed_data.sum(numeric_only=True)
-        sum_row_daily['Date'] = 'Total'
-        final_processed_data = final_processed_data._append(sum_row_daily, ignore_index=True)
+    # Initialize the processed data DataFrame with the full date range
+    final_processed_data = build_daily_frame(daily_totals)
 
-        # Save the final aggregated daily DataFrame to Excel
-        final_processed_data.to_excel('final_details_daily.xlsx', index=False)
-        print("Daily details saved to 'final_details_daily.xlsx'.")
+    # Per-file counts of dropped and out-of-band rows, to reconcile the reports against the source files
+    quality.save('.', 'final_details')
 
-    # Define numeric columns for use in both monthly and custom reports
-    numeric_cols = final_processed_data.columns.drop('Date')
+    if generate_daily:
+        if save_daily_report(final_processed_data, 'final_details_daily.xlsx'):
+            print("Daily details saved to 'final_details_daily.xlsx'.")
+        else:
+            print("Daily details unchanged, 'final_details_daily.xlsx' is up to date.")
 
-    # Create a month-wise summary by grouping and summing the daily data
     if generate_monthly:
-        final_processed_data['Month'] = pd.to_datetime(final_processed_data['Date'], errors='coerce').dt.to_period('M')
-        
-        # Select numeric columns for summation, excluding the 'Date' column
-        numeric_cols_monthly = final_processed_data.columns.drop(['Date', 'Month'])
-        
-        # Group by 'Month' and sum the numeric columns
-        month_wise_summary = final_processed_data.groupby('Month')[numeric_cols_monthly].sum().reset_index()
-
-        # Calculate and append the sum row for the monthly data
-        sum_row_monthly = month_wise_summary.sum(numeric_only=True)
-        sum_row_monthly['Month'] = 'Total'
-        month_wise_summary = month_wise_summary._append(sum_row_monthly, ignore_index=True)
-
-        # Save the month-wise summary to Excel
-        month_wise_summary.to_excel('final_details_monthly.xlsx', index=False)
-        print("Monthly summary saved to 'final_details_monthly.xlsx'.")
+        if save_monthly_report(final_processed_data, 'final_details_monthly.xlsx'):
+            print("Monthly summary saved to 'final_details_monthly.xlsx'.")
+        else:
+            print("Monthly summary unchanged, 'final_details_monthly.xlsx' is up to date.")
 
     # Generate a report for the specified date range
     if start_date and end_date:
-        filtered_data = final_processed_data[
-            (final_processed_data['Date'] >= start_date) &
-            (final_processed_data['Date'] <= end_date)
-        ]
-
-        # Calculate the sum row for the specified date range
-        sum_row_custom = filtered_data[numeric_cols].sum(numeric_only=True)
-        sum_row_custom['Date'] = 'Total'  # Label for the sum row
-        
-        # Append the sum row to the DataFrame
-        filtered_data = filtered_data._append(sum_row_custom, ignore_index=True)
-
-        # Drop the 'Month' column for the custom date range file if it exists
-        if 'Month' in filtered_data.columns:
-            filtered_data = filtered_data.drop(columns='Month')
-
-        # Save the updated DataFrame with the sum row to Excel
-        filtered_data.to_excel('custom_date_range_details.xlsx', index=False)
-        print(f"Details for {start_date} to {end_date} saved to 'custom_date_range_details.xlsx'.")
+        if save_custom_report(final_processed_data, start_date, end_date, 'custom_date_range_details.xlsx'):
+            print(f"Details for {start_date} to {end_date} saved to 'custom_date_range_details.xlsx'.")
+        else:
+            print(f"Details for {start_date} to {end_date} unchanged, 'custom_date_range_details.xlsx' is up to date.")
 
 def main():
     print("=== ANPR Fine Details Processing Tool ===")
@@ -0,0 +1,244 @@
+import pandas as pd
+import os
+import math
+import tempfile
+import threading
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is then not reported
+    resource = None
+
+# A parsed DataFrame takes several times the size of its CSV text, and the aggregation
+# makes filtered copies on top of that. Chosen from runs on synthetic challan histories.
+ROW_MEMORY_FACTOR = 12
+
+# Memory a worker process needs before it has read anything (interpreter, pandas, openpyxl)
+WORKER_BASE_BYTES = 120 * 1024 * 1024
+
+# Part of the budget held back for the interpreter's own growth and allocator slack
+SAFETY_FRACTION = 0.15
+
+# Never read less than this many rows at a time, smaller chunks only add overhead
+MIN_CHUNK_ROWS = 1000
+
+# How often MemoryMonitor samples the memory of this process and its worker processes
+SAMPLE_INTERVAL = 0.1
+
+UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2, 'G': 1024 ** 3, 'GB': 1024 ** 3}
+
+def parse_memory_size(text):
+    """Parse a size such as '512M', '2G' or '1500MB' into bytes."""
+    text = text.strip().upper()
+    number = text.rstrip('KMGB')
+    unit = text[len(number):]
+    if unit not in UNITS or not number:
+        raise ValueError(f"Invalid memory size: {text}. Use e.g. 512M or 2G.")
+    return int(float(number) * UNITS[unit])
+
+def process_rss(pid='self'):
+    """Resident memory of a process in bytes, or 0 if it cannot be read."""
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def current_rss():
+    """Resident memory of this process in bytes, or 0 if it cannot be read."""
+    return process_rss()
+
+def descendant_pids(pid):
+    """Process ids of all children of `pid` and their children, read from /proc."""
+    children = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # The parent id is the second field after the parenthesised command name
+                parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    descendants = []
+    pending = [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            descendants.append(child)
+            pending.append(child)
+    return descendants
+
+class MemoryMonitor:
+    """Sample the summed resident memory of this process and all its child processes in a background thread.
+
+    ru_maxrss only gives the peak of each process on its own, while the budget caps their sum.
+    Peaks shorter than SAMPLE_INTERVAL can be missed.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_processes = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.sample()
+            self.stop_event.wait(self.interval)
+
+    def sample(self):
+        pids = [os.getpid()] + descendant_pids(os.getpid())
+        total = sum(process_rss(pid) for pid in pids)
+        if total > self.peak_total:
+            self.peak_total = total
+            self.peak_processes = len(pids)
+
+def peak_rss():
+    """Peak resident memory of this process and of its largest worker process, in bytes."""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return own, children
+
+def report_peak_memory(max_memory, monitor=None):
+    """Print the peak memory of the run against the budget, combined over all processes if a MemoryMonitor ran."""
+    own, children = peak_rss()
+    if own is None:
+        print("Peak memory usage is not available on this platform.")
+    else:
+        message = f"Peak memory per process: {own / 1024 ** 2:.0f} MB in this process"
+        if children:
+            message += f", {children / 1024 ** 2:.0f} MB in the largest worker process"
+        print(f"{message} (budget {max_memory / 1024 ** 2:.0f} MB).")
+
+    if monitor is not None:
+        monitor.stop()
+        monitor.sample()
+        if monitor.peak_total:
+            verdict = "within" if monitor.peak_total <= max_memory else "over"
+            print(f"Peak combined memory: {monitor.peak_total / 1024 ** 2:.0f} MB across {monitor.peak_processes} process(es), "
+                  f"sampled every {monitor.interval}s, {verdict} the budget of {max_memory / 1024 ** 2:.0f} MB.")
+
+def estimate_row_bytes(filepath, sample_lines=2000, skip_lines=0):
+    """Average length in bytes of the data lines at the start of a CSV file."""
+    lengths = []
+    with open(filepath, 'rb') as file:
+        for number, line in enumerate(file):
+            if number < skip_lines + 1:
+                continue
+            lengths.append(len(line))
+            if len(lengths) >= sample_lines:
+                break
+    return max(sum(lengths) / len(lengths), 1) if lengths else 100
+
+def plan_execution(max_memory, row_bytes, workers=None):
+    """Choose the number of worker processes and the rows read per chunk so the run stays under max_memory.
+
+    Returns (workers, chunk_rows). With more than one worker, the chunks are parsed in that many pool
+    processes next to this one, and each of them pays WORKER_BASE_BYTES, so fewer of them are used
+    when the budget is tight. Raises ValueError if the budget cannot fit a single chunk.
+    """
+    available = max_memory * (1 - SAFETY_FRACTION) - current_rss()
+    bytes_per_row = row_bytes * ROW_MEMORY_FACTOR
+    minimum_chunk_bytes = MIN_CHUNK_ROWS * bytes_per_row
+    if available < minimum_chunk_bytes:
+        raise ValueError(f"A memory budget of {max_memory / 1024 ** 2:.0f} MB is too small, this process already uses {current_rss() / 1024 ** 2:.0f} MB.")
+
+    # A single worker parses in this process, whose memory is already subtracted. Pool processes
+    # come on top of it, each with its own interpreter and pandas as well as its chunk.
+    workers = workers or os.cpu_count() or 1
+    affordable = int(available // (WORKER_BASE_BYTES + minimum_chunk_bytes))
+    workers = min(workers, affordable) if affordable >= 2 else 1
+    if workers == 1:
+        chunk_bytes = available
+    else:
+        chunk_bytes = (available - workers * WORKER_BASE_BYTES) / workers
+
+    chunk_rows = max(MIN_CHUNK_ROWS, int(chunk_bytes // bytes_per_row))
+    return workers, chunk_rows
+
+def range_count(file_size, row_bytes, chunk_rows):
+    """Number of byte ranges to split a file into so each range holds at most chunk_rows rows."""
+    return max(1, math.ceil(file_size / (row_bytes * chunk_rows)))
+
+def combine(left, right):
+    # concat + groupby keeps integer counts as integers, DataFrame.add would turn them into floats
+    return pd.concat([left, right]).groupby(level=0).sum()
+
+class SpillingAggregator:
+    """Sum per-day partial aggregates, spilling them to disk when they outgrow max_bytes.
+
+    Partials are DataFrames indexed by date with numeric columns. They are combined in memory,
+    and once the combined frame is larger than max_bytes it is written to a compact pickle file.
+    result() adds the spilled files back one at a time, so only one is in memory at once.
+    """
+
+    def __init__(self, max_bytes=None, spill_directory=None):
+        self.max_bytes = max_bytes
+        self.spill_directory = spill_directory
+        self.combined = None
+        self.spill_files = []
+        # Only a directory made by _spill is removed again once the spill files are gone
+        self.temporary_directory = None
+
+    def add(self, partial):
+        if partial is None or partial.empty:
+            return
+        self.combined = partial if self.combined is None else combine(self.combined, partial)
+
+        if self.max_bytes is not None and self.combined.memory_usage(deep=True).sum() > self.max_bytes:
+            self._spill()
+
+    def _spill(self):
+        if self.spill_directory is None:
+            self.spill_directory = self.temporary_directory = tempfile.mkdtemp(prefix='anpr_spill_')
+        os.makedirs(self.spill_directory, exist_ok=True)
+        spill_file = os.path.join(self.spill_directory, f"partial_{len(self.spill_files)}.pkl")
+        self.combined.to_pickle(spill_file)
+        self.spill_files.append(spill_file)
+        self.combined = None
+
+    def discard(self):
+        """Drop the partials without combining them, e.g. when their file turned out to be unreadable."""
+        for spill_file in self.spill_files:
+            os.remove(spill_file)
+        self.spill_files = []
+        self.combined = None
+        self._remove_temporary_directory()
+
+    def _remove_temporary_directory(self):
+        if self.temporary_directory is not None:
+            os.rmdir(self.temporary_directory)
+            self.spill_directory = self.temporary_directory = None
+
+    def result(self):
+        """Streaming reduction of the in-memory and spilled partials into the final per-day totals."""
+        total = self.combined
+        for spill_file in self.spill_files:
+            partial = pd.read_pickle(spill_file)
+            total = partial if total is None else combine(total, partial)
+            os.remove(spill_file)
+        self.spill_files = []
+        self.combined = None
+        self._remove_temporary_directory()
+        if total is None:
+            return pd.DataFrame()
+        return total.sort_index()
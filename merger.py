@@ -1,36 +1,81 @@
 import pandas as pd
 import os
 import sys
+import argparse
+from membudget import parse_memory_size, estimate_row_bytes, plan_execution, report_peak_memory, MemoryMonitor
+
+parser = argparse.ArgumentParser(description="Merge the challan CSV files in a folder into merged_output.csv.")
+parser.add_argument("input_folder", nargs="?", help="folder containing the CSV files")
+parser.add_argument("--max-memory", help="memory budget for the run, e.g. 512M or 2G; the files are then streamed in chunks")
+args = parser.parse_args()
 
 # Check if the folder path is provided as an argument
-if len(sys.argv) < 2:
+if not args.input_folder:
     print("Please provide the folder name containing the CSV files as an argument.")
     sys.exit(1)
 
 # Get the folder path from command-line argument
-input_folder = sys.argv[1]
+input_folder = args.input_folder
 
 # Check if the folder exists
 if not os.path.exists(input_folder):
     print(f"The folder {input_folder} does not exist.")
     sys.exit(1)
 
+max_memory = None
+if args.max_memory:
+    try:
+        max_memory = parse_memory_size(args.max_memory)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
 # Define the output file name
 output_file = "merged_output.csv"
 
 # Get all CSV files in the folder
 csv_files = [f for f in os.listdir(input_folder) if f.endswith('.csv')]
 
+if max_memory:
+    # Sample the memory of the run to report whether the budget held
+    monitor = MemoryMonitor().start()
+
+    # The in-memory merge below keeps every column of every file, so take the ordered union of all headers first
+    columns = []
+    for csv_file in csv_files:
+        header = pd.read_csv(os.path.join(input_folder, csv_file), skiprows=13, nrows=0)
+        columns += [column for column in header.columns if column not in columns]
+
+    # Stream each file into the output chunk by chunk, only one chunk is in memory at a time
+    pd.DataFrame(columns=columns).to_csv(output_file, index=False)
+    for csv_file in csv_files:
+        file_path = os.path.join(input_folder, csv_file)
+
+        try:
+            _, chunk_rows = plan_execution(max_memory, estimate_row_bytes(file_path, skip_lines=13), workers=1)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+        # Read the CSV file, skipping the first 13 rows and using the 14th row as header
+        with pd.read_csv(file_path, skiprows=13, chunksize=chunk_rows) as chunks:
+            for df in chunks:
+                df.reindex(columns=columns).to_csv(output_file, mode='a', header=False, index=False)
+
+    print(f"CSV files merged successfully into {output_file}")
+    report_peak_memory(max_memory, monitor)
+    sys.exit(0)
+
 # Initialize an empty DataFrame to store the merged data
 merged_data = pd.DataFrame()
 
 # Loop through each file
 for csv_file in csv_files:
     file_path = os.path.join(input_folder, csv_file)
-    
+
     # Read the CSV file, skipping the first 13 rows and using the 14th row as header
     df = pd.read_csv(file_path, skiprows=13)
-    
+
     # Append the data to the merged dataframe
     if merged_data.empty:
         # If it's the first file, keep the header
@@ -3,6 +3,11 @@ import os
 from openpyxl import Workbook
 from openpyxl.styles import Alignment
 from datetime import datetime
+from reportcache import save_excel
+from mmapreader import parallel_aggregate, guess_date_format, PARALLEL_THRESHOLD_BYTES
+from dataquality import QualityLog
+from membudget import parse_memory_size, estimate_row_bytes, plan_execution, range_count, report_peak_memory, MemoryMonitor, SpillingAggregator
+import argparse
 
 def find_column(data, possible_names):
     """Utility function to find the closest matching column from possible names."""
@@ -11,23 +16,39 @@ def find_column(data, possible_names):
             return name
     return None
 
-def process_and_generate_excel(input_file, output_file, generate_daily=False, generate_monthly=False, start_date=None, end_date=None):
-    # Load the CSV file (without skipping rows)
-    try:
-        # Read the CSV file with the first row as a header
-        data = pd.read_csv(input_file, low_memory=False)
-    except Exception as e:
-        print(f"Error reading {input_file}: {e}")
-        return
+def challan_checks(data, challan_dates, amounts, start_date=None, end_date=None):
+    """Reasons a row is dropped from or only partly counted in the report, in priority order."""
+    checks = [("Unparseable Challan Date", challan_dates.isna())]
+    if start_date and end_date:
+        challan_days = challan_dates.dt.normalize()
+        checks.append(("Challan Date Outside Selected Range", (challan_days < pd.Timestamp(start_date)) | (challan_days > pd.Timestamp(end_date))))
+    checks += [
+        ("Missing Or Non-numeric Amount", amounts.isna()),
+        ("Amount Outside 100/200-900/1000 Bands", ~((amounts == 100) | ((amounts >= 200) & (amounts <= 900)) | (amounts == 1000))),
+        ("Missing Challan Status", data['Challan Status'].isna())
+    ]
+    return checks
 
-    # Find the correct column for 'Challan Date'
-    challan_date_column = find_column(data, ['Challan Date'])
-    if not challan_date_column:
-        print(f"Challan Date column not found in the CSV. Exiting.")
-        return
+def aggregate_by_date(data, challan_date_column, start_date=None, end_date=None, quality=None, filename=None, date_format=None):
+    """Aggregate challan rows into per-date counts and amounts.
 
+    Every column is a plain count or sum, so results for different parts of the data can be
+    added together with a SpillingAggregator. If a QualityLog is given, rows that are dropped or fall
+    outside the fine bands are recorded in it under `filename`. Parts of one file must pass the
+    date_format of the whole file, see mmapreader.guess_date_format.
+    """
     # Ensure the 'Challan Date' column is properly parsed as a date
-    data[challan_date_column] = pd.to_datetime(data[challan_date_column], errors='coerce')
+    challan_dates = pd.to_datetime(data[challan_date_column], errors='coerce', format=date_format)
+
+    amounts = pd.to_numeric(data['Challan Amount'], errors='coerce')
+
+    # Classify the rows before the raw values are replaced, so the reject file shows the original values
+    if quality is not None:
+        quality.record(filename, data, challan_checks(data, challan_dates, amounts, start_date, end_date))
+
+    # The bands below see the same parsed amounts as the checks, a text amount counts in no band
+    data[challan_date_column] = challan_dates
+    data['Challan Amount'] = amounts
 
     # Filter data if custom date range is provided
     if start_date and end_date:
@@ -55,6 +76,14 @@ def process_and_generate_excel(input_file, output_file, generate_daily=False, ge
     report_data['Total No. of 200-900\'s Collected'] = data[(data['Challan Amount'] >= 200) & (data['Challan Status'] != 'Pending') & (data['Challan Amount'] <= 900)].groupby(data[challan_date_column].dt.date).size()
     report_data['Total No. of 1000\'s Collected'] = data[(data['Challan Amount'] == 1000) & (data['Challan Status'] != 'Pending')].groupby(data[challan_date_column].dt.date).size()
 
+    # Calculate the collected fine amounts for each fine category
+    report_data['Collected Fine Amount in 100'] = data[(data['Challan Amount'] == 100) & (data['Challan Status'] != 'Pending')].groupby(data[challan_date_column].dt.date)['Challan Amount'].sum()
+    report_data['Collected Fine Amount in 200-900'] = data[(data['Challan Amount'] >= 200) & (data['Challan Amount'] <= 900) & (data['Challan Status'] != 'Pending')].groupby(data[challan_date_column].dt.date)['Challan Amount'].sum()
+    report_data['Collected Fine Amount in 1000'] = data[(data['Challan Amount'] == 1000) & (data['Challan Status'] != 'Pending')].groupby(data[challan_date_column].dt.date)['Challan Amount'].sum()
+
+    # Replace NaN with 0 in case of missing values
+    report_data.fillna(0, inplace=True)
+
     # Calculate the total number of cases with fines collected
     report_data['Total Fine Collected (No. of Cases)'] = (
         report_data['Total No. of 100\'s Collected'] +
@@ -62,11 +91,6 @@ def process_and_generate_excel(input_file, output_file, generate_daily=False, ge
         report_data['Total No. of 1000\'s Collected']
     )
 
-    # Calculate the collected fine amounts for each fine category
-    report_data['Collected Fine Amount in 100'] = data[(data['Challan Amount'] == 100) & (data['Challan Status'] != 'Pending')].groupby(data[challan_date_column].dt.date)['Challan Amount'].sum()
-    report_data['Collected Fine Amount in 200-900'] = data[(data['Challan Amount'] >= 200) & (data['Challan Amount'] <= 900) & (data['Challan Status'] != 'Pending')].groupby(data[challan_date_column].dt.date)['Challan Amount'].sum()
-    report_data['Collected Fine Amount in 1000'] = data[(data['Challan Amount'] == 1000) & (data['Challan Status'] != 'Pending')].groupby(data[challan_date_column].dt.date)['Challan Amount'].sum()
-
     # Calculate total amount collected by summing up the amounts for all fine categories
     report_data['Total Amount Collected'] = (
         report_data['Collected Fine Amount in 100'] +
@@ -74,9 +98,133 @@ def process_and_generate_excel(input_file, output_file, generate_daily=False, ge
         report_data['Collected Fine Amount in 1000']
     )
 
-    # Replace NaN with 0 in case of missing values
-    report_data.fillna(0, inplace=True)
+    return report_data
+
+def aggregate_with_quality(data, challan_date_column, start_date, end_date, filename, date_format=None):
+    # Worker side of the parallel reader, each range returns its own quality counts
+    quality = QualityLog()
+    report_data = aggregate_by_date(data, challan_date_column, start_date, end_date, quality, filename, date_format)
+    return report_data, quality
+
+class QualityReducer:
+    """Reduce aggregate_with_quality results as they arrive: per-day totals and one QualityLog."""
+
+    def __init__(self, max_bytes=None):
+        self.totals = SpillingAggregator(max_bytes=max_bytes)
+        self.quality = QualityLog()
+
+    def add(self, partial):
+        report_data, quality = partial
+        self.totals.add(report_data)
+        self.quality.merge(quality)
+
+    def result(self):
+        return self.totals.result(), self.quality
+
+def aggregate_in_chunks(input_file, chunk_rows, quality, max_memory, start_date=None, end_date=None):
+    """Aggregate a CSV chunk_rows rows at a time, returns None if the Challan Date column is missing."""
+    filename = os.path.basename(input_file)
+    # Per-day totals are small, spill them only if they grow past a tenth of the budget
+    aggregator = SpillingAggregator(max_bytes=max_memory // 10)
+
+    # Every chunk is parsed with the format of the file's first date, like a single read of the whole file
+    date_format = None
+    format_known = False
+
+    with pd.read_csv(input_file, low_memory=False, chunksize=chunk_rows) as chunks:
+        for data in chunks:
+            challan_date_column = find_column(data, ['Challan Date'])
+            if not challan_date_column:
+                return None
+            if not format_known and data[challan_date_column].notna().any():
+                date_format = guess_date_format(data[challan_date_column])
+                format_known = True
+            aggregator.add(aggregate_by_date(data, challan_date_column, start_date, end_date, quality, filename, date_format))
+
+    return aggregator.result()
+
+def skip_missing_date_column(quality, filename, output_file):
+    print("Challan Date column not found in the CSV. Exiting.")
+    quality.skip_file(filename, "Challan Date column not found")
+    save_quality(quality, output_file)
+
+def save_quality(quality, output_file):
+    # Next to the workbook and named after it, e.g. data_quality/final_report_counts.csv
+    report_name = os.path.splitext(os.path.basename(output_file))[0]
+    quality.save(os.path.dirname(os.path.abspath(output_file)), report_name)
+
+def process_and_generate_excel(input_file, output_file, generate_daily=False, generate_monthly=False, start_date=None, end_date=None, max_memory=None):
+    filename = os.path.basename(input_file)
+    quality = QualityLog()
+
+    if not os.path.exists(input_file):
+        print(f"The file {input_file} does not exist.")
+        return
+
+    large_file = os.path.getsize(input_file) >= PARALLEL_THRESHOLD_BYTES
+
+    # With a memory budget, pick the worker count and the rows held in memory at once to fit it
+    workers = None
+    parts = None
+    if max_memory:
+        row_bytes = estimate_row_bytes(input_file)
+        try:
+            workers, chunk_rows = plan_execution(max_memory, row_bytes)
+        except ValueError as e:
+            print(e)
+            return
+        parts = range_count(os.path.getsize(input_file), row_bytes, chunk_rows)
+        print(f"Memory budget {max_memory / 1024 ** 2:.0f} MB: {workers} worker process(es), {chunk_rows} rows per chunk.")
 
+    if max_memory and (not large_file or workers == 1):
+        try:
+            report_data = aggregate_in_chunks(input_file, chunk_rows, quality, max_memory, start_date, end_date)
+        except Exception as e:
+            print(f"Error reading {input_file}: {e}")
+            return
+
+        if report_data is None:
+            skip_missing_date_column(quality, filename, output_file)
+            return
+
+    # Large files (e.g. merged_output.csv from merger.py) are split across all cores
+    elif large_file:
+        try:
+            result = parallel_aggregate(input_file, aggregate_with_quality, ['Challan Date', 'Challan Amount', 'Challan Status'], ('Challan Date', start_date, end_date, filename), workers=workers, parts=parts, reducer=QualityReducer(max_memory // 10 if max_memory else None), date_column='Challan Date')
+        except Exception as e:
+            print(f"Error reading {input_file}: {e}")
+            return
+
+        if result is None:
+            skip_missing_date_column(quality, filename, output_file)
+            return
+
+        report_data, file_quality = result
+        quality.merge(file_quality)
+    else:
+        # Load the CSV file (without skipping rows)
+        try:
+            # Read the CSV file with the first row as a header
+            data = pd.read_csv(input_file, low_memory=False)
+        except Exception as e:
+            print(f"Error reading {input_file}: {e}")
+            return
+
+        # Find the correct column for 'Challan Date'
+        challan_date_column = find_column(data, ['Challan Date'])
+        if not challan_date_column:
+            skip_missing_date_column(quality, filename, output_file)
+            return
+
+        report_data = aggregate_by_date(data, challan_date_column, start_date, end_date, quality, filename)
+
+    # Per-file counts of dropped and out-of-band rows, to reconcile the report against the source file
+    save_quality(quality, output_file)
+
+    save_report(report_data, output_file, generate_monthly)
+
+def save_report(report_data, output_file, generate_monthly=False):
+    """Write per-date aggregates from aggregate_by_date as the final workbook, by month if requested."""
     # After processing, aggregate the data by date
     if generate_monthly:
         report_data.index = pd.to_datetime(report_data.index)
@@ -88,6 +236,13 @@ def process_and_generate_excel(input_file, output_file, generate_daily=False, ge
     if isinstance(final_report.index, pd.PeriodIndex):
         final_report.index = final_report.index.astype(str)
 
+    # Skip the openpyxl serialization if the same report was already written
+    if save_excel(final_report, output_file, 'mergerreport', lambda path: write_workbook(final_report, path)):
+        print(f"Final Excel report saved at: {output_file}")
+    else:
+        print(f"Final Excel report unchanged at: {output_file}")
+
+def write_workbook(final_report, output_file):
     # Prepare the final Excel report in the desired format
     wb = Workbook()
     ws = wb.active
@@ -187,9 +342,20 @@ def process_and_generate_excel(input_file, output_file, generate_daily=False, ge
 
     # Save the final report to an Excel file
     wb.save(output_file)
-    print(f"Final Excel report saved at: {output_file}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Generate the challan report from a single CSV file.")
+    parser.add_argument("--max-memory", help="memory budget for the run, e.g. 512M or 2G")
+    args = parser.parse_args()
+
+    max_memory = None
+    if args.max_memory:
+        try:
+            max_memory = parse_memory_size(args.max_memory)
+        except ValueError as e:
+            print(e)
+            return
+
     print("=== ANPR Fine Details Processing Tool ===")
     print("Please choose an option:")
     print("1. Generate Daily Details Report")
@@ -230,8 +396,14 @@ def main():
     # Set the output file name based on the user's selection
     output_file = 'final_report.xlsx'
 
+    # With a budget, sample the memory of this process and its workers to report whether it held
+    monitor = MemoryMonitor().start() if max_memory else None
+
     # Call the processing function with the specified options
-    process_and_generate_excel(input_file, output_file, generate_daily, generate_monthly, start_date, end_date)
+    process_and_generate_excel(input_file, output_file, generate_daily, generate_monthly, start_date, end_date, max_memory)
+
+    if max_memory:
+        report_peak_memory(max_memory, monitor)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,170 @@
+import pandas as pd
+import os
+import io
+import csv
+import mmap
+import concurrent.futures
+from pandas.tseries.api import guess_datetime_format
+from membudget import SpillingAggregator
+
+# Files smaller than this are read with a plain pd.read_csv, splitting them is not worth the process start-up
+PARALLEL_THRESHOLD_BYTES = 256 * 1024 * 1024
+
+# Data lines read after the header to find the first date of a file
+DATE_SAMPLE_LINES = 1000
+
+# Strings pd.to_datetime skips as missing when it infers a format
+MISSING_DATE_STRINGS = ('', 'NaT', 'nat', 'NAT', 'nan', 'NaN', 'NAN')
+
+def guess_date_format(values):
+    """Return the format pd.to_datetime would infer for `values`, or None to parse each value on its own.
+
+    pd.to_datetime takes the format from the first non-missing value. Chunks and byte ranges of one
+    file must all be parsed with the format of the file's first date, otherwise each part guesses
+    its own and a part whose first day is 12 or less swaps day and month.
+    """
+    for value in values:
+        if pd.isna(value) or value in MISSING_DATE_STRINGS:
+            continue
+        if not isinstance(value, str):
+            return None
+        return guess_datetime_format(value)
+    return None
+
+class MmapRangeReader(io.RawIOBase):
+    """Read-only file object over the byte range [start, end) of a memory-mapped file."""
+
+    def __init__(self, mm, start, end):
+        self._view = memoryview(mm)
+        self._pos = start
+        self._end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._end - self._pos)
+        if size <= 0:
+            return 0
+        buffer[:size] = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def close(self):
+        # Release the view so the underlying mmap can be closed
+        self._view.release()
+        super().close()
+
+def find_header(mm, required_columns, max_skip=20):
+    """Locate the header row among the first lines of the file, like the skiprows loop in main.py.
+
+    Returns the list of column names and the byte offset where the data rows start,
+    or (None, None) if no line within max_skip rows has all the required columns.
+    """
+    offset = 0
+    for _ in range(max_skip + 1):
+        newline = mm.find(b'\n', offset)
+        line_end = len(mm) if newline == -1 else newline + 1
+        line = mm[offset:line_end].decode('utf-8-sig', errors='replace').strip('\r\n')
+        columns = next(csv.reader([line]), [])
+        if all(column in columns for column in required_columns):
+            return columns, line_end
+        if newline == -1:
+            break
+        offset = line_end
+    return None, None
+
+def split_ranges(mm, start, parts):
+    """Split [start, len(mm)) into at most `parts` byte ranges that each end on a newline.
+
+    Quoted fields with embedded newlines are not supported, the challan exports do not have them.
+    """
+    size = len(mm)
+    step = max((size - start) // max(parts, 1), 1)
+    ranges = []
+    range_start = start
+    while range_start < size:
+        boundary = range_start + step
+        if boundary >= size or len(ranges) == parts - 1:
+            range_end = size
+        else:
+            newline = mm.find(b'\n', boundary)
+            range_end = size if newline == -1 else newline + 1
+        ranges.append((range_start, range_end))
+        range_start = range_end
+    return ranges
+
+def first_date_format(mm, data_offset, columns, date_column):
+    """Guess the date format of `date_column` from the first data lines after the header."""
+    sample_end = data_offset
+    for _ in range(DATE_SAMPLE_LINES):
+        newline = mm.find(b'\n', sample_end)
+        if newline == -1:
+            sample_end = len(mm)
+            break
+        sample_end = newline + 1
+    if sample_end == data_offset:
+        return None
+
+    # Read the sample like the ranges are read, so missing values are recognised the same way
+    sample = pd.read_csv(io.BytesIO(mm[data_offset:sample_end]), header=None, names=columns, usecols=[date_column], low_memory=False)
+    return guess_date_format(sample[date_column])
+
+def _aggregate_range(filepath, start, end, columns, aggregate, aggregate_args):
+    # Each worker maps the file itself, the pages are shared with the other workers through the page cache
+    with open(filepath, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with io.BufferedReader(MmapRangeReader(mm, start, end)) as reader:
+            data = pd.read_csv(reader, header=None, names=columns, low_memory=False)
+    return aggregate(data, *aggregate_args)
+
+def parallel_aggregate(filepath, aggregate, required_columns, aggregate_args=(), workers=None, parts=None, reducer=None, date_column=None):
+    """Parse and aggregate one large CSV on every core.
+
+    The file is split at newline-aligned byte offsets after the header, each range is parsed and
+    passed to `aggregate(data, *aggregate_args)` in a worker process. The partial results are
+    handed to `reducer.add` as they complete, and `reducer.result()` is returned. The default
+    reducer is a SpillingAggregator, which sums partial daily aggregates indexed by date.
+    `aggregate` must be a module-level function. `parts` splits the file into more ranges than
+    workers, so each range is small enough for a memory budget. If `date_column` is given, the
+    format of its first date is guessed once and passed to `aggregate` as an extra last argument,
+    so every range parses dates the same way.
+    Returns None if the header row could not be found.
+    """
+    workers = workers or os.cpu_count() or 1
+    if reducer is None:
+        reducer = SpillingAggregator()
+
+    with open(filepath, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            columns, data_offset = find_header(mm, required_columns)
+            if columns is None:
+                return None
+            ranges = split_ranges(mm, data_offset, max(parts or workers, workers))
+            if date_column is not None:
+                aggregate_args = tuple(aggregate_args) + (first_date_format(mm, data_offset, columns, date_column),)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        reducer.add(_aggregate_range(filepath, start, end, columns, aggregate, aggregate_args))
+
+    elif ranges:
+        print(f"Splitting {os.path.basename(filepath)} into {len(ranges)} ranges across {min(workers, len(ranges))} processes")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+            # Keep at most two ranges per worker in flight and reduce each result as soon as it
+            # arrives, so memory does not grow with the number of ranges
+            remaining = iter(ranges)
+            in_flight = set()
+            while True:
+                for start, end in remaining:
+                    in_flight.add(executor.submit(_aggregate_range, filepath, start, end, columns, aggregate, aggregate_args))
+                    if len(in_flight) >= 2 * workers:
+                        break
+                if not in_flight:
+                    break
+                done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    reducer.add(future.result())
+
+    return reducer.result()
@@ -0,0 +1,348 @@
+import pandas as pd
+import os
+import sys
+import json
+import gzip
+import socket
+import hashlib
+import runpy
+import argparse
+from datetime import datetime
+from main import build_daily_frame, save_daily_report, save_monthly_report, save_custom_report
+from mergerreport import find_column, save_report
+
+# updated_pending is a script without a .py extension, so it cannot be imported by name
+save_pending_report = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'updated_pending'))['save_report']
+
+# Partial aggregate files are gzip text: one JSON header line, then CSV records
+FORMAT_NAME = 'anpr-partial'
+FORMAT_VERSION = 1
+
+# One record per date, exact challan amount and status, so every report's bands can be derived at merge time.
+# 'Date Type' is 'challan' for rows keyed by Challan Date and 'payment' for rows keyed by Payment Date.
+RECORD_KEYS = ['Date Type', 'Date', 'Amount', 'Status']
+RECORD_COLUMNS = RECORD_KEYS + ['Cases', 'Total']
+
+def read_challan_csv(filepath):
+    # Try reading the CSV with varying numbers of rows skipped, like main.read_payment_csv
+    for skip in range(0, 21):
+        try:
+            data = pd.read_csv(filepath, skiprows=skip, low_memory=False)
+
+            # Check if the required columns exist
+            if 'Challan Amount' in data.columns and ('Payment Date' in data.columns or 'Challan Date' in data.columns):
+                return data
+        except pd.errors.ParserError:
+            continue
+    return None
+
+def aggregate_records(data, date_column, date_type):
+    """Count cases and sum amounts per date, amount and status for one date column."""
+    dates = pd.to_datetime(data[date_column], errors='coerce')
+    amounts = pd.to_numeric(data['Challan Amount'], errors='coerce')
+    if 'Challan Status' in data.columns:
+        statuses = data['Challan Status'].fillna('').astype(str)
+    else:
+        statuses = pd.Series('', index=data.index)
+
+    # Rows without a usable date do not appear in any report
+    valid = dates.notna()
+    rows = pd.DataFrame({
+        'Date Type': date_type,
+        'Date': dates[valid].dt.date,
+        'Amount': amounts[valid],
+        'Status': statuses[valid],
+        'Cases': 1,
+        'Total': amounts[valid].fillna(0)
+    })
+    return rows.groupby(RECORD_KEYS, dropna=False, as_index=False)[['Cases', 'Total']].sum()
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def list_input_files(paths, shard=None):
+    """Expand directories to their CSV files and keep only this shard's share, given as (index, count)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(path, f) for f in os.listdir(path) if f.endswith('.csv')]
+        else:
+            files.append(path)
+
+    files = sorted(files, key=os.path.basename)
+    if shard:
+        index, count = shard
+        files = [f for number, f in enumerate(files) if number % count == index - 1]
+    return files
+
+def build_partial(files):
+    """Aggregate a set of challan exports into partial records plus the provenance of each source file."""
+    records = []
+    sources = []
+    seen = {}
+    host = socket.gethostname()
+
+    for filepath in files:
+        filename = os.path.basename(filepath)
+        print(f"Processing file: {filename}")
+        source = {
+            'file': filename,
+            'sha256': file_sha256(filepath),
+            'size': os.path.getsize(filepath),
+            'host': host,
+            'built': datetime.now().isoformat(timespec='seconds'),
+            'rows': 0
+        }
+        sources.append(source)
+
+        # A re-downloaded export under another name would count its rows twice
+        if source['sha256'] in seen:
+            print(f"{filename} has the same content as {seen[source['sha256']]}. Skipping this file.")
+            source['skipped'] = f"Same content as {seen[source['sha256']]}"
+            continue
+        seen[source['sha256']] = filename
+
+        data = read_challan_csv(filepath)
+        if data is None:
+            print(f"Valid header not found in {filename}. Skipping this file.")
+            source['skipped'] = "Valid header not found"
+            continue
+
+        source['rows'] = len(data)
+        challan_date_column = find_column(data, ['Challan Date', 'Challan_Date', 'challan_date'])
+        if challan_date_column:
+            records.append(aggregate_records(data, challan_date_column, 'challan'))
+        if 'Payment Date' in data.columns:
+            records.append(aggregate_records(data, 'Payment Date', 'payment'))
+        print(f"Done processing file: {filename}")
+
+    return combine_records(records), sources
+
+def combine_records(records):
+    records = [r for r in records if not r.empty]
+    if not records:
+        return pd.DataFrame(columns=RECORD_COLUMNS)
+    combined = pd.concat(records, ignore_index=True)
+    return combined.groupby(RECORD_KEYS, dropna=False, as_index=False)[['Cases', 'Total']].sum()
+
+def write_partial(path, records, sources):
+    header = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'columns': RECORD_COLUMNS, 'sources': sources}
+    with gzip.open(path, 'wt', newline='') as partial_file:
+        partial_file.write(json.dumps(header) + '\n')
+        records[RECORD_COLUMNS].to_csv(partial_file, index=False)
+
+def read_partial(path):
+    """Read a partial aggregate file, returns (records, sources). Raises ValueError for unknown formats."""
+    with gzip.open(path, 'rt', newline='') as partial_file:
+        try:
+            header = json.loads(partial_file.readline())
+        except ValueError:
+            header = {}
+        if header.get('format') != FORMAT_NAME:
+            raise ValueError(f"{path} is not a partial aggregate file.")
+        if header.get('version', 0) > FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {header['version']}, this tool reads up to version {FORMAT_VERSION}.")
+
+        # Empty statuses stay empty strings, only a missing amount is read as NaN
+        records = pd.read_csv(partial_file, dtype={'Status': str}, keep_default_na=False, na_values={'Amount': ['']})
+
+    records['Date'] = pd.to_datetime(records['Date']).dt.date
+    return records, header['sources']
+
+def merge_partials(partials):
+    """Combine any number of (records, sources) pairs. The result does not depend on order or grouping."""
+    seen = {}
+    for _, sources in partials:
+        # Skipped files added no records, so they cannot be counted twice
+        for source in sources:
+            if source.get('skipped'):
+                continue
+            if source['sha256'] in seen:
+                raise ValueError(f"{source['file']} is in more than one partial (also as {seen[source['sha256']]}), its rows would be counted twice.")
+            seen[source['sha256']] = source['file']
+
+    records = combine_records([records for records, _ in partials])
+    sources = [source for _, sources in partials for source in sources]
+    return records, sources
+
+def payment_daily_totals(records):
+    """Per payment date totals in the layout of main.aggregate_payments."""
+    payments = records[records['Date Type'] == 'payment']
+    amount = payments['Amount']
+    cases = payments['Cases']
+    total = payments['Total']
+    rows = pd.DataFrame({
+        "No.of Cases Fine Collected": cases,
+        "Total No. of 100 Rs Cases": cases.where(amount == 100, 0),
+        "Collected Fine Amount in 100 Rs": total.where(amount == 100, 0),
+        "Total No. of 200 Rs Cases": cases.where(amount == 200, 0),
+        "Collected Fine Amount in 200 Rs": total.where(amount == 200, 0),
+        "Total No. of 1000 Rs Cases": cases.where(amount == 1000, 0),
+        "Collected Fine Amount in 1000 Rs": total.where(amount == 1000, 0),
+        "Total No. of Cases Fine Collected": cases,
+        "Total Fine Amount Collected": total
+    })
+    return rows.groupby(payments['Date']).sum()
+
+def challan_report_data(records, start_date=None, end_date=None, middle_band='200-900'):
+    """Per challan date totals in the layout of mergerreport.aggregate_by_date.
+
+    With middle_band='200' the middle band only holds 200 Rs challans, the layout of updated_pending.
+    """
+    challans = records[records['Date Type'] == 'challan']
+
+    # Filter data if custom date range is provided
+    if start_date and end_date:
+        challans = challans[(challans['Date'] >= start_date) & (challans['Date'] <= end_date)]
+
+    amount = challans['Amount']
+    cases = challans['Cases']
+    total = challans['Total']
+    completed = challans['Status'] != 'Pending'
+    band_100 = amount == 100
+    if middle_band == '200':
+        band_middle = amount == 200
+    else:
+        band_middle = (amount >= 200) & (amount <= 900)
+    band_1000 = amount == 1000
+
+    rows = pd.DataFrame({
+        'Total Number of Cases': cases,
+        'Number of Cases Completed': cases.where(completed, 0),
+        'Total Cases Pending': cases.where(~completed, 0),
+        'Total No. of Cases in 100': cases.where(band_100, 0),
+        f'Total No. of Cases in {middle_band}': cases.where(band_middle, 0),
+        'Total No. of Cases in 1000': cases.where(band_1000, 0),
+        'Total No. of 100\'s Collected': cases.where(band_100 & completed, 0),
+        f'Total No. of {middle_band}\'s Collected': cases.where(band_middle & completed, 0),
+        'Total No. of 1000\'s Collected': cases.where(band_1000 & completed, 0),
+        'Collected Fine Amount in 100': total.where(band_100 & completed, 0),
+        f'Collected Fine Amount in {middle_band}': total.where(band_middle & completed, 0),
+        'Collected Fine Amount in 1000': total.where(band_1000 & completed, 0)
+    })
+    report_data = rows.groupby(challans['Date']).sum()
+
+    # Calculate the total number of cases with fines collected
+    report_data['Total Fine Collected (No. of Cases)'] = (
+        report_data['Total No. of 100\'s Collected'] +
+        report_data[f'Total No. of {middle_band}\'s Collected'] +
+        report_data['Total No. of 1000\'s Collected']
+    )
+
+    # Calculate total amount collected by summing up the amounts for all fine categories
+    report_data['Total Amount Collected'] = (
+        report_data['Collected Fine Amount in 100'] +
+        report_data[f'Collected Fine Amount in {middle_band}'] +
+        report_data['Collected Fine Amount in 1000']
+    )
+
+    return report_data
+
+def generate_reports(records, reports_directory, start_date=None, end_date=None):
+    os.makedirs(reports_directory, exist_ok=True)
+
+    if (records['Date Type'] == 'payment').any():
+        final_processed_data = build_daily_frame([payment_daily_totals(records)])
+
+        daily_report_path = os.path.join(reports_directory, 'ANPR_payment_details_daily.xlsx')
+        if save_daily_report(final_processed_data, daily_report_path):
+            print(f"Daily details saved to '{daily_report_path}'.")
+        else:
+            print(f"Daily details unchanged, '{daily_report_path}' is up to date.")
+
+        monthly_report_path = os.path.join(reports_directory, 'ANPR_payment_details_monthly.xlsx')
+        if save_monthly_report(final_processed_data, monthly_report_path):
+            print(f"Monthly summary saved to '{monthly_report_path}'.")
+        else:
+            print(f"Monthly summary unchanged, '{monthly_report_path}' is up to date.")
+
+        if start_date and end_date:
+            custom_report_path = os.path.join(reports_directory, f'ANPR_payment_details_{start_date}_to_{end_date}.xlsx')
+            if save_custom_report(final_processed_data, start_date, end_date, custom_report_path):
+                print(f"Details for {start_date} to {end_date} saved to '{custom_report_path}'.")
+            else:
+                print(f"Details for {start_date} to {end_date} unchanged, '{custom_report_path}' is up to date.")
+    else:
+        print("No Payment Date records in the partials, skipping the payment reports.")
+
+    if (records['Date Type'] == 'challan').any():
+        # mergerreport.py's 100/200-900/1000 bands and updated_pending's 100/200/1000 bands
+        for middle_band, save, name in [('200-900', save_report, 'final_report'), ('200', save_pending_report, 'final_report_pending')]:
+            save(challan_report_data(records, middle_band=middle_band), os.path.join(reports_directory, f'{name}.xlsx'))
+            save(challan_report_data(records, middle_band=middle_band), os.path.join(reports_directory, f'{name}_monthly.xlsx'), generate_monthly=True)
+
+            if start_date and end_date:
+                report_data = challan_report_data(records, start_date, end_date, middle_band)
+                if report_data.empty:
+                    print(f"No challans between {start_date} and {end_date}, skipping the custom {name} report.")
+                else:
+                    save(report_data, os.path.join(reports_directory, f'{name}_{start_date}_to_{end_date}.xlsx'))
+    else:
+        print("No Challan Date records in the partials, skipping the challan reports.")
+
+def parse_shard(text):
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard {text}, use e.g. 1/3.")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"Invalid shard {text}, the index must be between 1 and {count}.")
+    return index, count
+
+def parse_date(text):
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid date format. Please use YYYY-MM-DD.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and merge partial aggregates of challan reports, e.g. one per machine.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build-partial', help="aggregate a shard of CSV files into a partial aggregate file")
+    build.add_argument('inputs', nargs='+', help="CSV files or directories containing them")
+    build.add_argument('-o', '--output', required=True, help="partial aggregate file to write")
+    build.add_argument('--shard', type=parse_shard, help="only take every N-th file starting at I, given as I/N")
+
+    merge = commands.add_parser('merge-partials', help="combine partial aggregate files into the final reports")
+    merge.add_argument('partials', nargs='+', help="partial aggregate files")
+    merge.add_argument('--reports-dir', default='Reports', help="directory for the Excel reports (default: Reports)")
+    merge.add_argument('--output-partial', help="also write the merged partial, to merge it further up")
+    merge.add_argument('--no-reports', action='store_true', help="only write --output-partial")
+    merge.add_argument('--start-date', type=parse_date, help="start date for custom range reports (YYYY-MM-DD)")
+    merge.add_argument('--end-date', type=parse_date, help="end date for custom range reports (YYYY-MM-DD)")
+
+    args = parser.parse_args()
+
+    if args.command == 'build-partial':
+        files = list_input_files(args.inputs, args.shard)
+        records, sources = build_partial(files)
+        write_partial(args.output, records, sources)
+        print(f"Partial aggregate of {len(sources)} file(s) saved to '{args.output}'.")
+        return
+
+    try:
+        records, sources = merge_partials([read_partial(path) for path in args.partials])
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    hosts = sorted({source['host'] for source in sources})
+    skipped = [source['file'] for source in sources if source.get('skipped')]
+    print(f"Merged {len(args.partials)} partials covering {len(sources)} files from {', '.join(hosts) or 'no hosts'}.")
+    if skipped:
+        print(f"Files skipped when the partials were built: {', '.join(skipped)}")
+
+    if args.output_partial:
+        write_partial(args.output_partial, records, sources)
+        print(f"Merged partial aggregate saved to '{args.output_partial}'.")
+
+    if not args.no_reports:
+        generate_reports(records, args.reports_dir, args.start_date, args.end_date)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import pandas as pd
+import os
+import json
+import shutil
+import hashlib
+
+# Where finished workbooks are kept, keyed by the hash of their content
+CACHE_DIRECTORY = os.environ.get('ANPR_REPORT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'anpr_reports'))
+
+# Least recently used workbooks are evicted once the cache grows past either limit
+CACHE_MAX_ENTRIES = 200
+CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+# Bump when the layout of any report changes so old cached workbooks are not reused
+CACHE_VERSION = 1
+
+def report_key(frame, spec):
+    """Hash the data going into a report together with a description of how it is rendered."""
+    digest = hashlib.sha256()
+    digest.update(repr((CACHE_VERSION, spec, list(map(str, frame.columns)))).encode())
+    digest.update(pd.util.hash_pandas_object(frame.astype(str), index=True).values.tobytes())
+    return digest.hexdigest()
+
+def _load_outputs():
+    # Which key each output file was last written from, with its size and mtime at that point
+    outputs_path = os.path.join(CACHE_DIRECTORY, 'outputs.json')
+    try:
+        with open(outputs_path) as outputs_file:
+            return json.load(outputs_file)
+    except (OSError, ValueError):
+        return {}
+
+def _save_outputs(outputs):
+    outputs_path = os.path.join(CACHE_DIRECTORY, 'outputs.json')
+    temporary_path = f"{outputs_path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as outputs_file:
+        json.dump(outputs, outputs_file, indent=2)
+    os.replace(temporary_path, outputs_path)
+
+def _evict():
+    entries = []
+    for entry in os.scandir(CACHE_DIRECTORY):
+        if entry.name.endswith('.xlsx'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    # Oldest first, cache hits refresh the mtime
+    entries.sort()
+    total_bytes = sum(size for _, size, _ in entries)
+    while entries and (len(entries) > CACHE_MAX_ENTRIES or total_bytes > CACHE_MAX_BYTES):
+        _, size, path = entries.pop(0)
+        os.remove(path)
+        total_bytes -= size
+
+def save_excel(frame, output_file, spec, write=None):
+    """Write `frame` to `output_file` unless the same report is already there or in the cache.
+
+    `spec` names the report type and anything else that changes the workbook for the same data.
+    `write(path)` does the actual serialization, by default frame.to_excel(path, index=False).
+    Returns False if the existing output file was already up to date, True otherwise.
+    """
+    key = report_key(frame, spec)
+    output_path = os.path.abspath(output_file)
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    outputs = _load_outputs()
+
+    # Skip entirely if the output file was written from the same key and not touched since
+    recorded = outputs.get(output_path)
+    if recorded and recorded['key'] == key and os.path.exists(output_path):
+        stat = os.stat(output_path)
+        if (stat.st_size, stat.st_mtime_ns) == (recorded['size'], recorded['mtime_ns']):
+            return False
+
+    cached_path = os.path.join(CACHE_DIRECTORY, f"{key}.xlsx")
+    if os.path.exists(cached_path):
+        shutil.copyfile(cached_path, output_path)
+        os.utime(cached_path)
+    else:
+        if write is None:
+            frame.to_excel(output_path, index=False)
+        else:
+            write(output_path)
+        shutil.copyfile(output_path, cached_path)
+        _evict()
+
+    stat = os.stat(output_path)
+    outputs[output_path] = {'key': key, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    _save_outputs(outputs)
+    return True
@@ -0,0 +1,277 @@
+import pandas as pd
+import os
+import sys
+import json
+import time
+import ctypes
+import ctypes.util
+import struct
+import argparse
+from datetime import datetime
+from main import aggregate_payment_file, build_daily_frame, save_daily_report, save_monthly_report, save_custom_report, PAYMENT_COLUMNS
+
+# How often the polling fallback rescans the folder
+POLL_INTERVAL = 2
+
+# A file counts as fully written once its size and modification time stop changing for this long
+SETTLE_SECONDS = 1
+
+# inotify event flags, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+
+def load_state(state_directory):
+    """Load the stored per-file daily totals, keyed by CSV file name."""
+    state = {}
+    manifest_path = os.path.join(state_directory, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return state
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    for filename, entry in manifest.items():
+        totals_path = os.path.join(state_directory, f"{filename}.pkl")
+        if os.path.exists(totals_path):
+            state[filename] = dict(entry, totals=pd.read_pickle(totals_path))
+    return state
+
+def save_state(state_directory, state, filename):
+    os.makedirs(state_directory, exist_ok=True)
+    totals_path = os.path.join(state_directory, f"{filename}.pkl")
+
+    if filename in state:
+        state[filename]['totals'].to_pickle(totals_path)
+    elif os.path.exists(totals_path):
+        os.remove(totals_path)
+
+    manifest = {name: {'size': entry['size'], 'mtime_ns': entry['mtime_ns']} for name, entry in state.items()}
+    manifest_path = os.path.join(state_directory, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def wait_until_written(filepath):
+    """Wait until the file stops growing. Returns its final stat, or None if it disappeared."""
+    try:
+        previous = os.stat(filepath)
+        while True:
+            time.sleep(SETTLE_SECONDS)
+            current = os.stat(filepath)
+            if (current.st_size, current.st_mtime_ns) == (previous.st_size, previous.st_mtime_ns):
+                return current
+            previous = current
+    except FileNotFoundError:
+        return None
+
+def changed_dates_between(old_totals, new_totals):
+    """Return the dates whose totals differ between two per-file daily aggregates."""
+    dates = old_totals.index.union(new_totals.index)
+    old_totals = old_totals.reindex(index=dates, columns=PAYMENT_COLUMNS, fill_value=0)
+    new_totals = new_totals.reindex(index=dates, columns=PAYMENT_COLUMNS, fill_value=0)
+    return set(dates[(old_totals != new_totals).any(axis=1)])
+
+def refresh_file(directory, filename, state, state_directory):
+    """Re-aggregate one CSV if it changed and return the set of dates whose totals moved."""
+    filepath = os.path.join(directory, filename)
+    entry = state.get(filename)
+    old_totals = entry['totals'] if entry else pd.DataFrame(columns=PAYMENT_COLUMNS)
+
+    # Unchanged files are skipped without waiting, so a restart over a large folder stays fast
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        stat = None
+    if stat is not None and entry and (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+        return set()
+
+    if stat is not None:
+        stat = wait_until_written(filepath)
+    if stat is None:
+        if entry is None:
+            return set()
+        print(f"File removed: {filename}")
+        del state[filename]
+        save_state(state_directory, state, filename)
+        return changed_dates_between(old_totals, pd.DataFrame(columns=PAYMENT_COLUMNS))
+
+    if entry and (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+        return set()
+
+    print(f"Processing file: {filename}")
+    new_totals = aggregate_payment_file(filepath)
+    if new_totals is None:
+        new_totals = pd.DataFrame(columns=PAYMENT_COLUMNS)
+
+    state[filename] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'totals': new_totals}
+    save_state(state_directory, state, filename)
+    print(f"Done processing file: {filename}")
+    return changed_dates_between(old_totals, new_totals)
+
+def refresh_files(directory, filenames, state, state_directory):
+    """Refresh several CSVs, a file that fails to read is reported and left as it was in the state."""
+    changed_dates = set()
+    for filename in sorted(filenames):
+        try:
+            changed_dates |= refresh_file(directory, filename, state, state_directory)
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+    return changed_dates
+
+def regenerate_reports(state, reports_directory, changed_dates=None, start_date=None, end_date=None):
+    """Rewrite the reports in Reports/ that cover any of the changed dates, or all of them if changed_dates is None."""
+    final_processed_data = build_daily_frame([entry['totals'] for entry in state.values()])
+    first_date = final_processed_data['Date'].iloc[0]
+    last_date = final_processed_data['Date'].iloc[-1]
+
+    if changed_dates is None:
+        changed_dates = {first_date, last_date} | ({start_date} if start_date else set())
+
+    # Dates outside the report frame do not show up in any report
+    changed_dates = {date for date in changed_dates if first_date <= date <= last_date}
+    if not changed_dates:
+        return False
+
+    os.makedirs(reports_directory, exist_ok=True)
+
+    daily_report_path = os.path.join(reports_directory, 'ANPR_payment_details_daily.xlsx')
+    if save_daily_report(final_processed_data, daily_report_path):
+        print(f"Daily details saved to '{daily_report_path}'.")
+
+    monthly_report_path = os.path.join(reports_directory, 'ANPR_payment_details_monthly.xlsx')
+    if save_monthly_report(final_processed_data, monthly_report_path):
+        print(f"Monthly summary saved to '{monthly_report_path}'.")
+
+    if start_date and end_date and any(start_date <= date <= end_date for date in changed_dates):
+        custom_report_filename = f'ANPR_payment_details_{start_date}_to_{end_date}.xlsx'
+        custom_report_path = os.path.join(reports_directory, custom_report_filename)
+        if save_custom_report(final_processed_data, start_date, end_date, custom_report_path):
+            print(f"Details for {start_date} to {end_date} saved to '{custom_report_path}'.")
+
+    return True
+
+def open_inotify(directory):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fd = libc.inotify_init1(os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        error = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(error, f"inotify_add_watch failed for {directory}")
+    return fd
+
+def inotify_events(fd):
+    """Yield the set of CSV file names that were written, moved or deleted, one batch per read."""
+    try:
+        while True:
+            buffer = os.read(fd, 64 * 1024)
+            names = set()
+            offset = 0
+            while offset < len(buffer):
+                _, _, _, length = struct.unpack_from('iIII', buffer, offset)
+                name = buffer[offset + 16:offset + 16 + length].rstrip(b'\0').decode(errors='replace')
+                offset += 16 + length
+                if name.endswith('.csv'):
+                    names.add(name)
+            if names:
+                yield names
+    finally:
+        os.close(fd)
+
+def snapshot_directory(directory):
+    return {
+        entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns)
+        for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith('.csv')
+    }
+
+def polling_events(directory, previous):
+    """Yield the set of CSV file names that appeared, changed or disappeared since the last scan."""
+    while True:
+        time.sleep(POLL_INTERVAL)
+        current = snapshot_directory(directory)
+        names = {name for name in previous.keys() | current.keys() if previous.get(name) != current.get(name)}
+        previous = current
+        if names:
+            yield names
+
+def watch_events(directory, use_polling=False):
+    if not use_polling and sys.platform.startswith('linux'):
+        try:
+            events = inotify_events(open_inotify(directory))
+            print(f"Watching {directory} with inotify")
+            return events
+        except OSError as e:
+            print(f"inotify is not available ({e}), falling back to polling")
+    print(f"Watching {directory} by polling every {POLL_INTERVAL}s")
+    return polling_events(directory, snapshot_directory(directory))
+
+def watch(directory, start_date=None, end_date=None, use_polling=False):
+    reports_directory = os.path.join(directory, "Reports")
+    state_directory = os.path.join(reports_directory, ".daily_totals")
+
+    # Start watching before the initial scan so no file written in between is missed
+    events = watch_events(directory, use_polling)
+
+    state = load_state(state_directory)
+
+    # Catch up on files that were added, changed or removed while the daemon was not running
+    filenames = {f for f in os.listdir(directory) if f.endswith('.csv')} | set(state)
+    refresh_files(directory, filenames, state, state_directory)
+
+    # Always write every report once at start-up, they may not exist yet. Dates whose reports
+    # could not be written stay pending, None means every report is still pending.
+    pending_dates = None
+    try:
+        regenerate_reports(state, reports_directory, pending_dates, start_date, end_date)
+        pending_dates = set()
+    except Exception as e:
+        print(f"Error writing reports: {e}")
+
+    for names in events:
+        started = time.perf_counter()
+        changed_dates = refresh_files(directory, names, state, state_directory)
+        if pending_dates is not None:
+            pending_dates |= changed_dates
+
+        # Keep watching if the reports cannot be written, e.g. while a workbook is open in Excel
+        try:
+            if regenerate_reports(state, reports_directory, pending_dates, start_date, end_date):
+                print(f"Reports updated in {time.perf_counter() - started:.2f}s.")
+            pending_dates = set()
+        except Exception as e:
+            print(f"Error writing reports: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a folder of challan reports and keep the payment reports up to date.")
+    parser.add_argument("directory", help="directory containing the CSV files, e.g. anpr")
+    parser.add_argument("--start-date", help="start date for a custom range report (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="end date for a custom range report (YYYY-MM-DD)")
+    parser.add_argument("--poll", action="store_true", help="poll the folder instead of using inotify")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"The folder {args.directory} does not exist.")
+        sys.exit(1)
+
+    start_date = None
+    end_date = None
+    if args.start_date and args.end_date:
+        try:
+            start_date = datetime.strptime(args.start_date, '%Y-%m-%d').date()
+            end_date = datetime.strptime(args.end_date, '%Y-%m-%d').date()
+        except ValueError:
+            print("Invalid date format. Please use YYYY-MM-DD.")
+            sys.exit(1)
+
+    try:
+        watch(args.directory, start_date, end_date, args.poll)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+if __name__ == "__main__":
+    main()